@@ -1,26 +1,148 @@
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-import requests
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse
+import aiohttp
+import asyncio
+import hashlib
+import io
 import os
 from google import genai
 import json
 import re
 import time
+from collections import OrderedDict
 from typing import Dict, List, Optional, Set, Tuple
-from paper_content_fetcher import PaperContentFetcher
+from paper_content_fetcher import PaperContentFetcher, MAX_CONTENT_CHARS
 
-app = Flask(__name__)
-CORS(app)
+app = FastAPI()
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"]
+)
 
 # Set API key environment variable for Gemini
 os.environ['GEMINI_API_KEY'] = 'YOUR_API_KEY_HERE'
 
+# One pooled aiohttp session for the whole server; created on startup so
+# every traversal reuses the same warm connections
+http_session: Optional[aiohttp.ClientSession] = None
+
+@app.on_event("startup")
+async def _open_http_session():
+    global http_session
+    http_session = make_http_session()
+
+@app.on_event("shutdown")
+async def _close_http_session():
+    if http_session is not None:
+        await http_session.close()
+
+# Hoisted out of the per-paper hot path so they aren't rebuilt per call
+ARXIV_ID_RE = re.compile(r'(\d{4}\.\d{4,5})')
+PAPER_DETAILS_FIELDS = ("paperId,externalIds,title,abstract,year,"
+                        "authors,venue,citationCount,referenceCount,openAccessPdf")
+PAPER_REFS_FIELDS = "paperId,externalIds,title,abstract,year,authors,contexts,intents"
+
+# Shared HTTP settings: one pooled session per traversal keeps TCP/TLS
+# connections alive across calls to the same host
+HTTP_USER_AGENT = "MathaDAG/1.0"
+HTTP_POOL_SIZE = 16
+
+def make_http_session() -> aiohttp.ClientSession:
+    """Create the pooled aiohttp session shared by a traversal"""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+        headers={"User-Agent": HTTP_USER_AGENT}
+    )
+
 class SemanticScholarAPI:
-    def __init__(self):
+    # Cached metadata is considered fresh for a week
+    CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+    # Max entries held in the in-memory LRU layer
+    MEMORY_CACHE_MAX_ENTRIES = 256
+
+    # Retry/backoff policy for transient API failures
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    MAX_ATTEMPTS = 3
+    BACKOFF_FACTOR = 0.5
+
+    def __init__(self, session: aiohttp.ClientSession):
         self.base_url = "https://api.semanticscholar.org/graph/v1"
         self.headers = {}
-    
-    def get_paper_details(self, paper_id: str) -> Optional[Dict]:
+        self.session = session
+        self.cache_dir = "meta_cache"
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # In-memory LRU in front of the disk cache: repeat lookups within a
+        # single traversal (shared ancestors, the 404 fallback re-lookup)
+        # shouldn't touch the filesystem, let alone the network
+        self._memory_cache = OrderedDict()
+
+    def _memory_get(self, key: str):
+        if key in self._memory_cache:
+            self._memory_cache.move_to_end(key)
+            return self._memory_cache[key]
+        return None
+
+    def _memory_put(self, key: str, value):
+        self._memory_cache[key] = value
+        self._memory_cache.move_to_end(key)
+        if len(self._memory_cache) > self.MEMORY_CACHE_MAX_ENTRIES:
+            self._memory_cache.popitem(last=False)
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{hashlib.sha256(key.encode()).hexdigest()}.json")
+
+    def _get_cached(self, key: str):
+        """Retrieve a cached API response, honoring the TTL"""
+        cached = self._memory_get(key)
+        if cached is not None:
+            return cached
+        cache_file = self._cache_path(key)
+        if os.path.exists(cache_file):
+            try:
+                if time.time() - os.path.getmtime(cache_file) > self.CACHE_TTL_SECONDS:
+                    return None
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    value = json.load(f)
+                self._memory_put(key, value)
+                return value
+            except Exception as e:
+                print(f"  - Error reading meta cache for {key}: {e}")
+        return None
+
+    def _put_cached(self, key: str, value):
+        """Cache a successful API response in memory and on disk"""
+        self._memory_put(key, value)
+        cache_file = self._cache_path(key)
+        try:
+            with open(cache_file, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+        except Exception as e:
+            print(f"  - Error writing meta cache for {key}: {e}")
+
+    async def _get_json(self, url: str, params: Dict) -> Tuple[int, object]:
+        """GET with exponential backoff on transient statuses.
+
+        Returns (status, payload) where payload is the decoded JSON on 200
+        and the error body text otherwise.
+        """
+        for attempt in range(self.MAX_ATTEMPTS):
+            async with self.session.get(url, params=params, headers=self.headers) as response:
+                if response.status == 200:
+                    return 200, await response.json()
+                error_text = await response.text()
+                if response.status in self.RETRY_STATUSES and attempt < self.MAX_ATTEMPTS - 1:
+                    delay = self.BACKOFF_FACTOR * (2 ** attempt)
+                    print(f"  - Got {response.status} from Semantic Scholar, retrying in {delay:.1f}s...")
+                    await asyncio.sleep(delay)
+                    continue
+                return response.status, error_text
+
+    async def get_paper_details(self, paper_id: str) -> Optional[Dict]:
         """Get paper details from Semantic Scholar"""
         # Handle different ID formats
         if paper_id.startswith("10.48550/arXiv."):
@@ -31,160 +153,184 @@ class SemanticScholarAPI:
         elif paper_id.startswith("arXiv:"):
             # Already in correct format
             pass
-        elif "arXiv" in paper_id.lower() or bool(re.match(r'^\d{4}\.\d{4,5}', paper_id)):
+        elif "arXiv" in paper_id.lower() or bool(ARXIV_ID_RE.match(paper_id)):
             # Try to extract ArXiv ID
-            match = re.search(r'(\d{4}\.\d{4,5})', paper_id)
+            match = ARXIV_ID_RE.search(paper_id)
             if match:
                 paper_id = f"arXiv:{match.group(1)}"
                 print(f"  - Extracted ArXiv ID: {paper_id}")
         
+        cached = self._get_cached(f"details:{paper_id}")
+        if cached is not None:
+            return cached
+
         url = f"{self.base_url}/paper/{paper_id}"
-        fields = [
-            "paperId", "externalIds", "title", "abstract", "year",
-            "authors", "venue", "citationCount", "referenceCount",
-            "openAccessPdf"
-        ]
-        params = {"fields": ",".join(fields)}
-        
+        params = {"fields": PAPER_DETAILS_FIELDS}
+
         try:
             print(f"  - Fetching paper details from: {url}")
-            response = requests.get(url, params=params, headers=self.headers)
-            if response.status_code == 200:
-                paper = response.json()
+            status, payload = await self._get_json(url, params)
+            if status == 200:
+                paper = payload
                 print(f"  - Found paper: {paper.get('title', 'Unknown')[:60]}...")
+                self._put_cached(f"details:{paper_id}", paper)
                 return paper
-            elif response.status_code == 429:
-                # Rate limit hit - wait and retry
-                print(f"  - Rate limit hit, waiting 2 seconds and retrying...")
-                time.sleep(2)
-                response = requests.get(url, params=params, headers=self.headers)
-                if response.status_code == 200:
-                    paper = response.json()
-                    print(f"  - Found paper: {paper.get('title', 'Unknown')[:60]}...")
-                    return paper
-                else:
-                    print(f"  - Error fetching paper after retry: {response.status_code} - {response.text}")
-                    return None
-            else:
-                print(f"  - Error fetching paper: {response.status_code} - {response.text}")
-                return None
+            print(f"  - Error fetching paper: {status} - {payload}")
+            return None
         except Exception as e:
             print(f"  - Request failed: {e}")
             return None
-    
-    def get_paper_references(self, paper_id: str) -> List[Dict]:
+
+    async def get_paper_references(self, paper_id: str) -> List[Dict]:
         """Get all references of a paper"""
+        cached = self._get_cached(f"refs:{paper_id}")
+        if cached is not None:
+            return cached
+
         url = f"{self.base_url}/paper/{paper_id}/references"
-        fields = [
-            "paperId", "externalIds", "title", "abstract", "year",
-            "authors", "contexts", "intents"
-        ]
         params = {
-            "fields": ",".join(fields),
+            "fields": PAPER_REFS_FIELDS,
             "limit": 100  # Limit for faster processing
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers)
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("data", [])
-            elif response.status_code == 429:
-                # Rate limit hit - wait and retry
-                print(f"    - Rate limit hit on references, waiting 2 seconds...")
-                time.sleep(2)
-                response = requests.get(url, params=params, headers=self.headers)
-                if response.status_code == 200:
-                    data = response.json()
-                    return data.get("data", [])
-                else:
-                    print(f"    - Error fetching references after retry: {response.status_code}")
-                    return []
-            else:
-                print(f"    - Error fetching references: {response.status_code}")
-                return []
+            status, payload = await self._get_json(url, params)
+            if status == 200:
+                references = payload.get("data", [])
+                self._put_cached(f"refs:{paper_id}", references)
+                return references
+            print(f"    - Error fetching references: {status}")
+            return []
         except Exception as e:
             print(f"    - Request failed: {e}")
             return []
 
-def extract_dependencies_with_gemini(paper_details: Dict, paper_content: Optional[str], references: List[Dict]) -> List[Dict]:
-    """Use Gemini to identify which references are actual dependencies with detailed reasoning"""
-    
-    paper_title = paper_details.get("title", "Unknown")
-    paper_abstract = paper_details.get("abstract", "")
-    
-    # Prepare reference list for Gemini
-    ref_list = []
-    ref_map = {}
-    for i, ref in enumerate(references):
-        cited_paper = ref.get("citedPaper", {})
-        if cited_paper:
-            ref_id = cited_paper.get("paperId")
-            title = cited_paper.get("title", "Unknown")
-            authors = cited_paper.get("authors", [])
-            author_names = ", ".join([a.get("name", "Unknown") for a in authors[:2]])
-            if len(authors) > 2:
-                author_names += " et al."
-            year = cited_paper.get("year", "N/A")
-            
-            contexts = ref.get("contexts", [])
-            context_text = " | ".join(contexts[:3]) if contexts else "No context available"
-            
-            ref_list.append(f"{i+1}. [{ref_id}] {title} ({author_names}, {year})")
-            ref_list.append(f"   Citation contexts: {context_text}")
-            ref_map[i+1] = {
-                "paper_id": ref_id,
-                "title": title,
-                "authors": author_names,
-                "year": year
-            }
-    
-    if not ref_list:
-        return []
-    
-    # Use full paper content if available, otherwise fall back to abstract
-    content_to_analyze = paper_content if paper_content else f"Title: {paper_title}\n\nAbstract: {paper_abstract}"
-    
-    # Truncate content if too long (Gemini has token limits)
-    max_content_length = 800000  # Characters
-    if len(content_to_analyze) > max_content_length:
-        content_to_analyze = content_to_analyze[:max_content_length] + "\n\n[Content truncated due to length...]"
-    
-    # Create prompt for Gemini
-    prompt = f"""You are analyzing a mathematics paper to identify its true dependencies. A true dependency is a reference whose mathematical results (theorems, lemmas, or definitions) are directly used in proving or establishing the results of the analyzed paper.
-
-PAPER CONTENT:
-{content_to_analyze}
-
-REFERENCES:
-{chr(10).join(ref_list)}
-
-TASK:
-Analyze each reference and determine if it's a true dependency. For each reference, provide:
+# Gemini response cache: prompts are deterministic (default temperature,
+# content + reference list), so identical calls can be answered from disk
+GEMINI_MODEL = "gemini-2.5-pro"
+GEMINI_CACHE_DIR = "gemini_cache"
+GEMINI_CACHE_TTL_SECONDS = 7 * 24 * 3600
+GEMINI_CACHE_ENABLED = True
+
+# Above this size, paper content is uploaded once through the Gemini File
+# API and referenced by URI instead of being inlined into every request body
+GEMINI_FILE_UPLOAD_MIN_CHARS = 100000
+
+# The File API expires uploads after ~48 hours; re-upload comfortably before
+# that so a long-running server never hands Gemini a stale URI
+GEMINI_FILE_UPLOAD_TTL_SECONDS = 46 * 3600
+
+# Uploads made this process, keyed by content hash and timestamped, so
+# re-analyzing the same paper (or retrying a level) never re-ships the bytes
+_gemini_uploaded_files: Dict[str, Tuple[object, float]] = {}
+
+def _upload_content_file(client, text: str):
+    """Upload paper content to the Gemini File API, reusing unexpired uploads"""
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    entry = _gemini_uploaded_files.get(digest)
+    if entry is not None:
+        uploaded, uploaded_at = entry
+        if time.time() - uploaded_at < GEMINI_FILE_UPLOAD_TTL_SECONDS:
+            return uploaded
+    uploaded = client.files.upload(
+        file=io.BytesIO(text.encode()),
+        config={"mime_type": "text/plain"}
+    )
+    _gemini_uploaded_files[digest] = (uploaded, time.time())
+    return uploaded
+
+# Response schema for dependency extraction; forces Gemini to emit valid
+# JSON in exactly the {"per_paper": [...]} shape the parser expects
+DEPENDENCY_SCHEMA = genai.types.Schema(
+    type=genai.types.Type.OBJECT,
+    properties={
+        "per_paper": genai.types.Schema(
+            type=genai.types.Type.ARRAY,
+            items=genai.types.Schema(
+                type=genai.types.Type.OBJECT,
+                properties={
+                    "paper_index": genai.types.Schema(type=genai.types.Type.INTEGER),
+                    "dependencies": genai.types.Schema(
+                        type=genai.types.Type.ARRAY,
+                        items=genai.types.Schema(
+                            type=genai.types.Type.OBJECT,
+                            properties={
+                                "reference_number": genai.types.Schema(type=genai.types.Type.INTEGER),
+                                "paper_id": genai.types.Schema(type=genai.types.Type.STRING),
+                                "is_dependency": genai.types.Schema(type=genai.types.Type.BOOLEAN),
+                                "reason": genai.types.Schema(type=genai.types.Type.STRING),
+                                "specific_elements": genai.types.Schema(
+                                    type=genai.types.Type.ARRAY,
+                                    items=genai.types.Schema(type=genai.types.Type.STRING)
+                                )
+                            },
+                            required=["reference_number", "is_dependency", "reason"]
+                        )
+                    )
+                },
+                required=["paper_index", "dependencies"]
+            )
+        )
+    },
+    required=["per_paper"]
+)
+
+# Phrases that signal a citation's mathematical results are actually used;
+# references whose contexts show none of these are filtered out before the
+# (expensive) Gemini call ever sees them
+DEPENDENCY_HINT_RE = re.compile(
+    r"theorem|lemma|proposition|by \[|definition|proof of|follows from|applying",
+    re.IGNORECASE
+)
+
+def _looks_like_dependency(ref: Dict) -> bool:
+    """Cheap preflight check: could this reference plausibly be a dependency?
+
+    Pure-background citations with no contexts, and citations whose contexts
+    contain none of the dependency phrases, are dropped without asking the
+    model; the prompt instructs Gemini to reject them anyway.
+    """
+    intents = ref.get("intents") or []
+    contexts = ref.get("contexts") or []
+    if not contexts:
+        # No evidence either way; only intent can disqualify it outright
+        return intents != ["background"]
+    return any(DEPENDENCY_HINT_RE.search(context) for context in contexts)
+
+# Fixed prompt boilerplate, hoisted to module scope so it isn't rebuilt per call
+GEMINI_INSTRUCTIONS = """You are analyzing mathematics papers to identify their true dependencies. A true dependency is a reference whose mathematical results (theorems, lemmas, or definitions) are directly used in proving or establishing the results of the analyzed paper."""
+
+GEMINI_TASK_INSTRUCTIONS = """TASK:
+For every paper above, analyze each of its references and determine if it's a true dependency. For each reference, provide:
 1. Whether it's a dependency (true/false)
 2. A specific reason explaining your decision
 3. If it's a dependency, list the specific mathematical elements (theorems, lemmas, definitions) that are used
 
 OUTPUT FORMAT:
-Return a JSON array with the following structure:
-{{
-  "dependencies": [
-    {{
-      "reference_number": 1,
-      "paper_id": "abc123",
-      "is_dependency": true,
-      "reason": "The paper directly uses Theorem 3.2 and Lemma 4.1 from this reference to prove the main result in Section 5",
-      "specific_elements": ["Theorem 3.2", "Lemma 4.1", "Definition 2.1"]
-    }},
-    {{
-      "reference_number": 2,
-      "paper_id": "def456",
-      "is_dependency": false,
-      "reason": "Only mentioned in the introduction for historical context and motivation",
-      "specific_elements": []
-    }}
+Return a single JSON object with one entry per paper, where paper_index matches the === PAPER N === heading:
+{
+  "per_paper": [
+    {
+      "paper_index": 1,
+      "dependencies": [
+        {
+          "reference_number": 1,
+          "paper_id": "abc123",
+          "is_dependency": true,
+          "reason": "The paper directly uses Theorem 3.2 and Lemma 4.1 from this reference to prove the main result in Section 5",
+          "specific_elements": ["Theorem 3.2", "Lemma 4.1", "Definition 2.1"]
+        },
+        {
+          "reference_number": 2,
+          "paper_id": "def456",
+          "is_dependency": false,
+          "reason": "Only mentioned in the introduction for historical context and motivation",
+          "specific_elements": []
+        }
+      ]
+    }
   ]
-}}
+}
 
 IMPORTANT:
 - Only mark as dependency if mathematical results are DIRECTLY USED in proofs or definitions
@@ -192,18 +338,190 @@ IMPORTANT:
 - Look for phrases like "by Theorem X in [Y]", "using the result from", "applying Lemma", "follows from"
 - Be conservative: when in doubt, it's likely NOT a dependency
 """
-    
+
+def _get_cached_gemini_result(cache_key: str) -> Optional[List[Dict]]:
+    """Retrieve a cached (already parsed) dependency list, honoring the TTL"""
+    if not GEMINI_CACHE_ENABLED:
+        return None
+    cache_file = os.path.join(GEMINI_CACHE_DIR, f"{cache_key}.json")
+    if os.path.exists(cache_file):
+        try:
+            if time.time() - os.path.getmtime(cache_file) > GEMINI_CACHE_TTL_SECONDS:
+                return None
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"    - Error reading Gemini cache: {e}")
+    return None
+
+def _cache_gemini_result(cache_key: str, dependencies: List[Dict]):
+    """Cache a parsed dependency list to disk"""
+    if not GEMINI_CACHE_ENABLED:
+        return
+    try:
+        if not os.path.exists(GEMINI_CACHE_DIR):
+            os.makedirs(GEMINI_CACHE_DIR)
+        cache_file = os.path.join(GEMINI_CACHE_DIR, f"{cache_key}.json")
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(dependencies, f)
+    except Exception as e:
+        print(f"    - Error writing Gemini cache: {e}")
+
+def extract_dependencies_with_gemini(papers: List[Tuple[Dict, Optional[str], List[Dict]]]) -> List[List[Dict]]:
+    """Use Gemini to identify which references are actual dependencies with detailed reasoning.
+
+    Accepts a batch of (paper_details, paper_content, references) tuples —
+    typically all papers at one BFS level — and analyzes them in a single
+    Gemini call, amortizing the instruction tokens and the request
+    round-trip. Returns one dependency list per input paper, in order.
+    """
+    results: List[List[Dict]] = [[] for _ in papers]
+
+    # Build one section per paper that has usable references
+    sections = []  # (paper_index, content_section, refs_section, ref_map)
+    for paper_index, (paper_details, paper_content, references) in enumerate(papers):
+        paper_title = paper_details.get("title", "Unknown")
+        paper_abstract = paper_details.get("abstract", "")
+
+        # Deduplicate references before numbering them: the API can return
+        # the same citedPaper twice with different contexts, and entries
+        # with no paperId can't become graph nodes anyway. Contexts of
+        # duplicates are merged so the model still sees all the evidence.
+        seen = {}
+        deduped = []
+        for ref in references:
+            pid = (ref.get("citedPaper") or {}).get("paperId")
+            if not pid:
+                continue
+            if pid in seen:
+                merged_contexts = seen[pid].setdefault("contexts", [])
+                for context in ref.get("contexts") or []:
+                    if context not in merged_contexts:
+                        merged_contexts.append(context)
+                continue
+            # Copy so merging doesn't mutate objects held by the refs cache
+            entry = dict(ref)
+            entry["contexts"] = list(ref.get("contexts") or [])
+            seen[pid] = entry
+            deduped.append(entry)
+
+        # Preflight-filter obvious non-dependencies so Gemini only has to
+        # rank the plausible ones
+        filtered = [ref for ref in deduped if _looks_like_dependency(ref)]
+        if len(filtered) < len(deduped):
+            print(f"    - Preflight filter dropped {len(deduped) - len(filtered)} of {len(deduped)} references")
+        deduped = filtered
+
+        # Prepare reference list for Gemini
+        ref_list = []
+        ref_map = {}
+        for i, ref in enumerate(deduped):
+            cited_paper = ref.get("citedPaper", {})
+            if cited_paper:
+                ref_id = cited_paper.get("paperId")
+                title = cited_paper.get("title", "Unknown")
+                authors = cited_paper.get("authors", [])
+                author_names = ", ".join([a.get("name", "Unknown") for a in authors[:2]])
+                if len(authors) > 2:
+                    author_names += " et al."
+                year = cited_paper.get("year", "N/A")
+
+                contexts = ref.get("contexts", [])
+                context_text = " | ".join(contexts[:3]) if contexts else "No context available"
+
+                ref_list.append(f"{i+1}. [{ref_id}] {title} ({author_names}, {year})")
+                ref_list.append(f"   Citation contexts: {context_text}")
+                ref_map[i+1] = {
+                    "paper_id": ref_id,
+                    "title": title,
+                    "authors": author_names,
+                    "year": year
+                }
+
+        if not ref_list:
+            continue
+
+        # Use full paper content if available, otherwise fall back to abstract
+        content_to_analyze = paper_content if paper_content else f"Title: {paper_title}\n\nAbstract: {paper_abstract}"
+
+        # Truncate content if too long (Gemini has token limits); PDF
+        # extraction already stops at this budget, but other sources can
+        # still exceed it
+        if len(content_to_analyze) > MAX_CONTENT_CHARS:
+            content_to_analyze = content_to_analyze[:MAX_CONTENT_CHARS] + "\n\n[Content truncated due to length...]"
+
+        content_section = f"=== PAPER {paper_index + 1} ===\n{content_to_analyze}"
+        refs_section = f"=== REFERENCES FOR PAPER {paper_index + 1} ===\n{chr(10).join(ref_list)}"
+        sections.append((paper_index, content_section, refs_section, ref_map))
+
+    if not sections:
+        return results
+
+    # Instructions and content sit up front, ahead of the per-call reference
+    # lists, so Gemini's implicit prefix cache can discount the shared part
+    # on repeat calls. The pieces are kept separate and sent as multipart
+    # contents so the (potentially megabyte-sized) paper content is never
+    # copied into one giant string.
+    content_block = "\n".join(section[1] for section in sections)
+    variable_suffix = "\n".join(section[2] for section in sections) + "\n\n" + GEMINI_TASK_INSTRUCTIONS
+
+    # The prompt fully determines the response, so cache by content hash,
+    # fed piecewise to avoid concatenating the parts. The cached value is
+    # one dependency list per prompt section, in order.
+    hasher = hashlib.sha256()
+    for piece in (GEMINI_MODEL, GEMINI_INSTRUCTIONS, content_block, variable_suffix):
+        hasher.update(piece.encode())
+    cache_key = hasher.hexdigest()
+    cached = _get_cached_gemini_result(cache_key)
+    if cached is not None and len(cached) == len(sections):
+        print(f"    - Gemini cache hit, skipping LLM call")
+        for (paper_index, _, _, _), dependencies in zip(sections, cached):
+            results[paper_index] = dependencies
+        return results
+
     try:
         # Create client inside the function to ensure API key is set
         client = genai.Client()
+
+        # Big papers go through the File API: upload once, reference by URI,
+        # so the bytes aren't re-shipped in every request body
+        content_parts = []
+        for _, content_section, _, _ in sections:
+            heading, _, body = content_section.partition("\n")
+            if len(body) > GEMINI_FILE_UPLOAD_MIN_CHARS:
+                try:
+                    uploaded = _upload_content_file(client, body)
+                    content_parts.append(genai.types.Part.from_text(text=heading + "\n"))
+                    content_parts.append(genai.types.Part.from_uri(
+                        file_uri=uploaded.uri, mime_type="text/plain"))
+                    continue
+                except Exception as e:
+                    print(f"    - File upload failed, inlining content: {e}")
+            content_parts.append(genai.types.Part.from_text(text=content_section + "\n"))
+
         # Try with retries
         for attempt in range(3):
             try:
                 # Use Gemini 2.5 Pro
-                response = client.models.generate_content(
-                    model="gemini-2.5-pro",
-                    contents=prompt
+                config = {
+                    "response_mime_type": "application/json",
+                    "response_schema": DEPENDENCY_SCHEMA
+                }
+                contents = (
+                    [genai.types.Part.from_text(text=GEMINI_INSTRUCTIONS)]
+                    + content_parts
+                    + [genai.types.Part.from_text(text=variable_suffix)]
                 )
+                # Stream the response so bytes accumulate while the model is
+                # still generating instead of waiting for the full payload
+                result_buf = bytearray()
+                for chunk in client.models.generate_content_stream(
+                    model=GEMINI_MODEL,
+                    contents=contents,
+                    config=config
+                ):
+                    if chunk.text:
+                        result_buf.extend(chunk.text.encode('utf-8'))
                 break
             except Exception as e:
                 if "503" in str(e) or "overloaded" in str(e).lower():
@@ -212,45 +530,40 @@ IMPORTANT:
                         time.sleep(3)
                         continue
                 raise
-        
-        # Parse JSON response
-        result_text = response.text.strip()
-        
-        # Extract JSON from the response (sometimes Gemini adds markdown formatting)
-        import re
-        json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-        if json_match:
-            result_text = json_match.group()
-        
-        result = json.loads(result_text)
-        dependencies = result.get("dependencies", [])
-        
-        # Process and return the results
-        processed_dependencies = []
-        for dep in dependencies:
-            if dep.get("is_dependency", False):
-                ref_num = dep.get("reference_number")
-                if ref_num in ref_map:
-                    processed_dependencies.append({
-                        "paper_id": ref_map[ref_num]["paper_id"],
-                        "title": ref_map[ref_num]["title"],
-                        "authors": ref_map[ref_num]["authors"],
-                        "year": ref_map[ref_num]["year"],
-                        "reason": dep.get("reason", ""),
-                        "specific_elements": dep.get("specific_elements", [])
-                    })
-        
-        return processed_dependencies
-        
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {e}")
-        print(f"Response text: {response.text[:500]}...")
-        # Fallback to simple extraction
-        return _fallback_dependency_extraction(references)
+
+        # The response schema guarantees valid JSON in the expected shape
+        result = json.loads(bytes(result_buf))
+
+        # Process the per-paper results back into input order
+        per_paper = {entry.get("paper_index"): entry.get("dependencies", [])
+                     for entry in result.get("per_paper", [])}
+        section_results = []
+        for paper_index, _, _, ref_map in sections:
+            processed_dependencies = []
+            for dep in per_paper.get(paper_index + 1, []):
+                if dep.get("is_dependency", False):
+                    ref_num = dep.get("reference_number")
+                    if ref_num in ref_map:
+                        processed_dependencies.append({
+                            "paper_id": ref_map[ref_num]["paper_id"],
+                            "title": ref_map[ref_num]["title"],
+                            "authors": ref_map[ref_num]["authors"],
+                            "year": ref_map[ref_num]["year"],
+                            "reason": dep.get("reason", ""),
+                            "specific_elements": dep.get("specific_elements", [])
+                        })
+            results[paper_index] = processed_dependencies
+            section_results.append(processed_dependencies)
+
+        # Store the parsed lists so cache hits also skip the JSON parse
+        _cache_gemini_result(cache_key, section_results)
+
+        return results
+
     except Exception as e:
         print(f"Gemini API error: {e}")
         # Fallback: use papers with methodology/result intents
-        return _fallback_dependency_extraction(references)
+        return [_fallback_dependency_extraction(references) for _, _, references in papers]
 
 def _fallback_dependency_extraction(references: List[Dict]) -> List[Dict]:
     """Fallback method using citation intents"""
@@ -275,153 +588,244 @@ def _fallback_dependency_extraction(references: List[Dict]) -> List[Dict]:
                 })
     return dependencies
 
-def build_dependency_graph(doi: str, max_depth: int = 2) -> Dict:
-    """Build the dependency graph starting from a DOI"""
-    api = SemanticScholarAPI()
-    content_fetcher = PaperContentFetcher()
-    
+async def build_dependency_graph(session: aiohttp.ClientSession, doi: str, max_depth: int = 2) -> Dict:
+    """Build the dependency graph starting from a DOI.
+
+    Traversal is breadth-first: all papers at the same depth are fetched
+    concurrently (paper details, full-text content and references) over the
+    server's shared HTTP session, since the workload is dominated by HTTP
+    round-trips. Graph mutation (node/edge bookkeeping and Gemini analysis)
+    happens sequentially on the main task so no locking is needed around the
+    counters.
+    """
     nodes = []
     edges = []
     processed = set()
     node_id_counter = 0
-    paper_id_to_node_id = {}
-    dependency_reasons = {}  # Store reasons for dependencies
-    
-    def process_paper(paper_id: str, depth: int, parent_node_id: Optional[int] = None):
-        nonlocal node_id_counter
-        
-        if paper_id in processed or depth > max_depth:
-            return
-        
-        processed.add(paper_id)
-        
-        # Get paper details
-        paper = api.get_paper_details(paper_id)
-        if not paper:
-            return
-        
-        # Create node
-        current_node_id = node_id_counter
-        paper_id_to_node_id[paper_id] = current_node_id
-        node_id_counter += 1
-        
-        # Extract author names
-        authors = paper.get("authors", [])
-        author_names = ", ".join([a.get("name", "Unknown") for a in authors[:3]])
-        if len(authors) > 3:
-            author_names += " et al."
-        
-        # Create short label for graph
-        title = paper.get("title", "Unknown")
-        short_title = title[:40] + "..." if len(title) > 40 else title
-        
-        # Fetch paper content if available
-        print(f"Processing paper: {title[:60]}... (Level {depth})")
-        paper_content, content_source = content_fetcher.fetch_paper_content(paper)
-        has_full_text = paper_content is not None
-        print(f"  - Full text: {'Yes' if has_full_text else 'No'} ({content_source})")
-        
-        nodes.append({
-            "id": current_node_id,
-            "label": short_title,
-            "title": title,
-            "year": paper.get("year", "N/A"),
-            "authors": author_names,
-            "level": depth,
-            "has_full_text": has_full_text,
-            "content_source": content_source
-        })
-        
-        # Add edge from parent with dependency reason if available
-        if parent_node_id is not None:
-            edge_key = f"{parent_node_id}-{current_node_id}"
-            edge_data = {
-                "from": parent_node_id,
-                "to": current_node_id
-            }
-            if edge_key in dependency_reasons:
-                edge_data["title"] = dependency_reasons[edge_key]["reason"]
-                edge_data["label"] = ", ".join(dependency_reasons[edge_key]["specific_elements"][:2])
-            edges.append(edge_data)
-        
-        # Get references and find dependencies
-        if depth < max_depth:
-            # Use the paper's actual Semantic Scholar ID for fetching references
-            ss_paper_id = paper.get('paperId')
-            references = api.get_paper_references(ss_paper_id)
-            
+
+    # Bound concurrent fetches to respect Semantic Scholar rate limits
+    semaphore = asyncio.Semaphore(8)
+
+    api = SemanticScholarAPI(session)
+    content_fetcher = PaperContentFetcher()
+
+    async def fetch_paper_data(paper_id: str, depth: int):
+        """Fetch details, content and (if not at max depth) references for one paper"""
+        async with semaphore:
+            paper = await api.get_paper_details(paper_id)
+            if not paper:
+                return None
+
+            title = paper.get("title", "Unknown")
+            print(f"Processing paper: {title[:60]}... (Level {depth})")
+            paper_content, content_source = await content_fetcher.fetch_paper_content(
+                session, paper
+            )
+            print(f"  - Full text: {'Yes' if paper_content is not None else 'No'} ({content_source})")
+
+            references = []
+            if depth < max_depth:
+                # Use the paper's actual Semantic Scholar ID for fetching references
+                references = await api.get_paper_references(paper.get('paperId'))
+
+            return paper, paper_content, content_source, references
+
+    # Each frontier entry is (paper_id, parent_node_id, dependency_info)
+    # where dependency_info carries the Gemini reasoning for the edge
+    frontier = [(doi, None, None)]
+    depth = 0
+
+    while frontier and depth <= max_depth:
+        # Deduplicate the level before fanning out fetches
+        level = []
+        for paper_id, parent_node_id, dep_info in frontier:
+            if paper_id not in processed:
+                processed.add(paper_id)
+                level.append((paper_id, parent_node_id, dep_info))
+
+        # Fetch phase: all papers at this depth concurrently
+        results = await asyncio.gather(
+            *[fetch_paper_data(paper_id, depth) for paper_id, _, _ in level],
+            return_exceptions=True
+        )
+
+        # Mutate phase: build nodes/edges and queue the next level
+        next_frontier = []
+        analysis_batch = []  # (node_id, paper, paper_content, references)
+        for (paper_id, parent_node_id, dep_info), result in zip(level, results):
+            if isinstance(result, Exception):
+                print(f"  - Failed to fetch {paper_id}: {result}")
+                continue
+            if result is None:
+                continue
+
+            paper, paper_content, content_source, references = result
+
+            # Create node
+            current_node_id = node_id_counter
+            node_id_counter += 1
+
+            # Extract author names
+            authors = paper.get("authors", [])
+            author_names = ", ".join([a.get("name", "Unknown") for a in authors[:3]])
+            if len(authors) > 3:
+                author_names += " et al."
+
+            # Create short label for graph
+            title = paper.get("title", "Unknown")
+            short_title = title[:40] + "..." if len(title) > 40 else title
+
+            nodes.append({
+                "id": current_node_id,
+                "label": short_title,
+                "title": title,
+                "year": paper.get("year", "N/A"),
+                "authors": author_names,
+                "level": depth,
+                "has_full_text": paper_content is not None,
+                "content_source": content_source
+            })
+
+            # Add edge from parent with dependency reason if available
+            if parent_node_id is not None:
+                edge_data = {
+                    "from": parent_node_id,
+                    "to": current_node_id
+                }
+                if dep_info:
+                    edge_data["title"] = dep_info["reason"]
+                    edge_data["label"] = ", ".join(dep_info["specific_elements"][:2])
+                edges.append(edge_data)
+
+            # Queue this paper's references for the level's dependency analysis
             if references:
-                # Use Gemini to identify true dependencies with full paper content
-                print(f"  - Found {len(references)} references, analyzing dependencies...")
-                dependencies = extract_dependencies_with_gemini(
-                    paper,
-                    paper_content,
-                    references
-                )
-                print(f"  - Identified {len(dependencies)} true dependencies")
-                
-                # Process each dependency
-                for dep in dependencies[:5]:  # Limit to 5 per level for performance
+                print(f"  - Found {len(references)} references for node {current_node_id}")
+                analysis_batch.append((current_node_id, paper, paper_content, references))
+
+        # Analyze the whole level's references in a single Gemini call,
+        # amortizing instruction tokens and the request round-trip
+        if analysis_batch:
+            print(f"  - Analyzing dependencies for {len(analysis_batch)} papers in one call...")
+            # The Gemini SDK call is blocking; keep it off the event loop so
+            # other in-flight analyses aren't stalled behind it
+            batch_results = await asyncio.to_thread(
+                extract_dependencies_with_gemini,
+                [(paper, paper_content, references)
+                 for _, paper, paper_content, references in analysis_batch]
+            )
+            queued_ids = {paper_id for paper_id, _, _ in next_frontier}
+            for (node_id, _, _, _), dependencies in zip(analysis_batch, batch_results):
+                print(f"  - Identified {len(dependencies)} true dependencies for node {node_id}")
+                enqueued = 0
+                for dep in dependencies:
+                    if enqueued >= 5:  # Limit to 5 per paper for performance
+                        break
                     dep_id = dep["paper_id"]
-                    
-                    # Store dependency reason for edge
-                    if dep_id not in processed:  # Only store if we'll actually process this paper
-                        future_node_id = node_id_counter + len([p for p in dependencies[:5] if p["paper_id"] not in processed and dependencies.index(p) < dependencies.index(dep)])
-                        edge_key = f"{current_node_id}-{future_node_id}"
-                        dependency_reasons[edge_key] = {
-                            "reason": dep["reason"],
-                            "specific_elements": dep["specific_elements"]
-                        }
-                    
-                    process_paper(dep_id, depth + 1, current_node_id)
-    
-    # Start processing from the given DOI
-    process_paper(doi, 0)
-    
+                    # Duplicate ids (within a paper or across siblings) and
+                    # already-built nodes shouldn't consume limit slots
+                    if dep_id in processed or dep_id in queued_ids:
+                        continue
+                    queued_ids.add(dep_id)
+                    next_frontier.append((dep_id, node_id, dep))
+                    enqueued += 1
+
+        frontier = next_frontier
+        depth += 1
+
     return {
         "nodes": nodes,
         "edges": edges
     }
 
-@app.route('/')
-def index():
-    return send_from_directory('.', 'index.html')
+async def _lookup_paper(paper_id: str) -> Optional[Dict]:
+    """One-off paper details lookup outside of a graph traversal"""
+    return await SemanticScholarAPI(http_session).get_paper_details(paper_id)
 
-@app.route('/analyze_paper', methods=['POST'])
-def analyze_paper():
+# Endpoint-level output cache: the graph for a given DOI and depth is
+# deterministic given the upstream caches, so repeat requests can skip the
+# traversal entirely
+GRAPH_CACHE_DIR = "graph_cache"
+GRAPH_CACHE_TTL_SECONDS = 24 * 3600
+graph_cache_stats = {"hits": 0, "misses": 0}
+
+def _graph_cache_path(doi: str, max_depth: int) -> str:
+    key = hashlib.sha256(f"{doi}:{max_depth}".encode()).hexdigest()
+    return os.path.join(GRAPH_CACHE_DIR, f"{key}.json")
+
+def _get_cached_graph(doi: str, max_depth: int) -> Optional[Dict]:
+    """Retrieve a cached graph response, honoring the TTL"""
+    cache_file = _graph_cache_path(doi, max_depth)
+    if os.path.exists(cache_file):
+        try:
+            if time.time() - os.path.getmtime(cache_file) > GRAPH_CACHE_TTL_SECONDS:
+                return None
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error reading graph cache for {doi}: {e}")
+    return None
+
+def _cache_graph(doi: str, max_depth: int, graph_data: Dict):
+    """Cache a built graph response to disk"""
+    try:
+        if not os.path.exists(GRAPH_CACHE_DIR):
+            os.makedirs(GRAPH_CACHE_DIR)
+        with open(_graph_cache_path(doi, max_depth), 'w', encoding='utf-8') as f:
+            json.dump(graph_data, f)
+    except Exception as e:
+        print(f"Error caching graph for {doi}: {e}")
+
+@app.get('/')
+async def index():
+    return FileResponse('index.html')
+
+@app.post('/analyze_paper')
+async def analyze_paper(request: Request):
     try:
-        data = request.json
+        data = await request.json()
         doi = data.get('doi', '').strip()
-        
+
         if not doi:
-            return jsonify({"error": "DOI is required"}), 400
-        
+            return JSONResponse({"error": "DOI is required"}, status_code=400)
+
+        max_depth = 2
+
+        # Serve from the output cache unless explicitly bypassed (?nocache=1)
+        if request.query_params.get('nocache') != '1':
+            cached_graph = _get_cached_graph(doi, max_depth)
+            if cached_graph is not None:
+                graph_cache_stats["hits"] += 1
+                print(f"=== Graph cache hit for DOI: {doi} ===")
+                return JSONResponse(cached_graph, headers={'X-Cache': 'HIT'})
+        graph_cache_stats["misses"] += 1
+
         print(f"\n=== Starting analysis for DOI: {doi} ===")
-        
+
         # Build dependency graph
-        graph_data = build_dependency_graph(doi)
-        
+        graph_data = await build_dependency_graph(http_session, doi, max_depth)
+
         if not graph_data["nodes"]:
             # More specific error message
-            api = SemanticScholarAPI()
-            paper = api.get_paper_details(doi)
+            paper = await _lookup_paper(doi)
             if not paper:
                 error_msg = f"Paper with identifier '{doi}' not found in Semantic Scholar. Please check the DOI/ID and try again."
                 print(f"Error: {error_msg}")
-                return jsonify({"error": error_msg}), 404
+                return JSONResponse({"error": error_msg}, status_code=404)
             else:
                 error_msg = "Paper found but no dependencies could be identified. This might be because the paper has no references or they couldn't be analyzed."
                 print(f"Error: {error_msg}")
-                return jsonify({"error": error_msg}), 404
-        
+                return JSONResponse({"error": error_msg}, status_code=404)
+
         print(f"=== Analysis complete: {len(graph_data['nodes'])} nodes, {len(graph_data['edges'])} edges ===\n")
-        return jsonify(graph_data)
-        
+        _cache_graph(doi, max_depth, graph_data)
+        return JSONResponse(graph_data, headers={'X-Cache': 'MISS'})
+
     except Exception as e:
         import traceback
         print(f"Error in analyze_paper: {e}")
         print(traceback.format_exc())
-        return jsonify({"error": f"Server error: {str(e)}"}), 500
+        return JSONResponse({"error": f"Server error: {str(e)}"}, status_code=500)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    import uvicorn
+    uvicorn.run(app, port=5000)
\ No newline at end of file
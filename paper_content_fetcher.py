@@ -1,193 +1,324 @@
-import requests
+import aiohttp
+import asyncio
 import arxiv
-import PyPDF2
+import concurrent.futures
+import multiprocessing
+import pypdfium2
+import threading
 import io
 import os
 import json
 import hashlib
+import zstandard
 from typing import Optional, Dict, Tuple
 from urllib.parse import quote
 
+# Above this page count, text extraction is split across worker processes
+PDF_PARALLEL_PAGE_THRESHOLD = 50
+
+# Downstream consumers (the Gemini prompt) truncate content at this many
+# characters, so stop decompressing pages once the budget is filled
+MAX_CONTENT_CHARS = 800000
+
+# PDFium is not thread-safe, and extraction runs on worker threads while the
+# traversal races several downloads at once: every in-process pypdfium2 use
+# must hold this lock (pool workers each get their own PDFium instance)
+_pdfium_lock = threading.Lock()
+
+# One shared process pool for parallel page extraction, created lazily with
+# the spawn context so we never fork from a worker thread of the
+# multithreaded server
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_pool
+
+def _extract_page_range(pdf_bytes: bytes, start: int, stop: int) -> str:
+    """Extract text for pages [start, stop); runs in a worker process.
+
+    Stops early once this slice alone exceeds the content budget, since the
+    combined document can only be longer.
+    """
+    pdf = pypdfium2.PdfDocument(pdf_bytes)
+    parts = []
+    total = 0
+    for page_num in range(start, stop):
+        page_text = pdf[page_num].get_textpage().get_text_range()
+        parts.append(page_text)
+        parts.append("\n")
+        total += len(page_text) + 1
+        if total >= MAX_CONTENT_CHARS:
+            break
+    return "".join(parts)
+
+def _extract_pdf_text(pdf_bytes: bytes) -> str:
+    """Extract all text from a PDF, parallelizing across pages for long documents"""
+    with _pdfium_lock:
+        pdf = pypdfium2.PdfDocument(pdf_bytes)
+        num_pages = len(pdf)
+
+        if num_pages <= PDF_PARALLEL_PAGE_THRESHOLD:
+            parts = []
+            total = 0
+            for page in pdf:
+                page_text = page.get_textpage().get_text_range()
+                parts.append(page_text)
+                parts.append("\n")
+                total += len(page_text) + 1
+                if total >= MAX_CONTENT_CHARS:
+                    break
+            return "".join(parts)[:MAX_CONTENT_CHARS].strip()
+
+    # Long documents: fan page ranges out to the shared process pool, where
+    # each worker runs its own PDFium; no lock needed around that
+    workers = os.cpu_count() or 1
+    chunk_size = (num_pages + workers - 1) // workers
+    ranges = [(start, min(start + chunk_size, num_pages))
+              for start in range(0, num_pages, chunk_size)]
+    parts = list(_get_pdf_pool().map(
+        _extract_page_range,
+        [pdf_bytes] * len(ranges),
+        [r[0] for r in ranges],
+        [r[1] for r in ranges]
+    ))
+    return "".join(parts)[:MAX_CONTENT_CHARS].strip()
+
 class PaperContentFetcher:
     def __init__(self):
         self.cache_dir = "paper_cache"
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
-    
-    def fetch_paper_content(self, paper_details: Dict) -> Tuple[Optional[str], str]:
+
+    async def fetch_paper_content(self, session: aiohttp.ClientSession, paper_details: Dict) -> Tuple[Optional[str], str]:
         """
         Fetch full paper content from various sources
-        
+
+        All eligible sources are raced concurrently and the first one to
+        return content wins; the rest are cancelled. Since each source is an
+        independent network fetch, this turns the expected latency from the
+        sum of the attempts into the minimum.
+
         Args:
+            session: Shared aiohttp session used for all HTTP fetches
             paper_details: Dictionary containing paper metadata from Semantic Scholar
-            
+
         Returns:
             Tuple of (content, source) where content is the extracted text and source indicates where it came from
         """
         paper_id = paper_details.get("paperId", "")
-        
+
         # Check cache first
         cached_content = self._get_cached_content(paper_id)
         if cached_content:
             return cached_content, "cache"
-        
-        # Try different methods to get paper content
+
         external_ids = paper_details.get("externalIds", {})
-        
+
+        async def labeled(source, coro):
+            return source, await coro
+
+        # Launch every eligible source concurrently
+        tasks = []
+
         # Method 1: Check if Semantic Scholar has openAccessPdf
         open_access_pdf = paper_details.get("openAccessPdf")
         if open_access_pdf and open_access_pdf.get("url"):
-            content = self._fetch_pdf_content(open_access_pdf["url"])
-            if content:
-                self._cache_content(paper_id, content)
-                return content, "semantic_scholar_pdf"
-        
+            tasks.append(asyncio.ensure_future(
+                labeled("semantic_scholar_pdf", self._fetch_pdf_content(session, open_access_pdf["url"]))))
+
         # Method 2: Try ArXiv if available
         arxiv_id = external_ids.get("ArXiv")
         if arxiv_id:
-            content = self._fetch_arxiv_content(arxiv_id)
-            if content:
-                self._cache_content(paper_id, content)
-                return content, "arxiv"
-        
+            tasks.append(asyncio.ensure_future(
+                labeled("arxiv", self._fetch_arxiv_content(session, arxiv_id))))
+
         # Method 3: Try Unpaywall with DOI
         doi = external_ids.get("DOI")
         if doi:
-            content = self._fetch_unpaywall_content(doi)
-            if content:
-                self._cache_content(paper_id, content)
-                return content, "unpaywall"
-        
+            tasks.append(asyncio.ensure_future(
+                labeled("unpaywall", self._fetch_unpaywall_content(session, doi))))
+
         # Method 4: Try CORE API
-        content = self._fetch_core_content(paper_details)
-        if content:
-            self._cache_content(paper_id, content)
-            return content, "core"
-        
+        tasks.append(asyncio.ensure_future(
+            labeled("core", self._fetch_core_content(session, paper_details))))
+
+        try:
+            for completed in asyncio.as_completed(tasks):
+                try:
+                    source, content = await completed
+                except Exception as e:
+                    print(f"    - Content source failed: {e}")
+                    continue
+                if content:
+                    self._cache_content(paper_id, content)
+                    return content, source
+        finally:
+            # Cancel whatever is still in flight
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
         # If all methods fail, return None
         return None, "not_found"
-    
-    def _fetch_pdf_content(self, pdf_url: str) -> Optional[str]:
+
+    async def _fetch_pdf_content(self, session: aiohttp.ClientSession, pdf_url: str) -> Optional[str]:
         """Download PDF and extract text content"""
         try:
-            response = requests.get(pdf_url, timeout=30)
-            if response.status_code == 200:
-                pdf_file = io.BytesIO(response.content)
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                
-                text = ""
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
-                
-                return text.strip()
+            async with session.get(pdf_url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                if response.status == 200:
+                    # Stream the body in chunks rather than buffering the
+                    # whole response object
+                    pdf_file = io.BytesIO()
+                    async for chunk in response.content.iter_chunked(65536):
+                        pdf_file.write(chunk)
+
+                    # Extraction is CPU-bound, so keep it off the event loop
+                    return await asyncio.to_thread(_extract_pdf_text, pdf_file.getvalue())
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             print(f"Error fetching PDF from {pdf_url}: {e}")
         return None
-    
-    def _fetch_arxiv_content(self, arxiv_id: str) -> Optional[str]:
+
+    async def _fetch_arxiv_content(self, session: aiohttp.ClientSession, arxiv_id: str) -> Optional[str]:
         """Fetch paper content from ArXiv"""
         try:
             # Clean the ArXiv ID - remove any prefixes
             if arxiv_id.startswith("arXiv:"):
                 arxiv_id = arxiv_id[6:]
-            
+
             print(f"    - Attempting to fetch ArXiv paper: {arxiv_id}")
-            
-            # Search for the paper
+
+            # The arxiv client is blocking, so run the lookup off-loop
             search = arxiv.Search(id_list=[arxiv_id])
-            paper = next(search.results())
-            
+            paper = await asyncio.to_thread(next, search.results())
+
             # Download PDF
             pdf_url = paper.pdf_url
             print(f"    - Found PDF URL: {pdf_url}")
-            return self._fetch_pdf_content(pdf_url)
+            return await self._fetch_pdf_content(session, pdf_url)
         except StopIteration:
             print(f"    - ArXiv paper {arxiv_id} not found")
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             print(f"    - Error fetching from ArXiv {arxiv_id}: {e}")
         return None
-    
-    def _fetch_unpaywall_content(self, doi: str) -> Optional[str]:
+
+    async def _fetch_unpaywall_content(self, session: aiohttp.ClientSession, doi: str) -> Optional[str]:
         """Fetch paper content using Unpaywall API"""
         try:
             # Unpaywall API endpoint
             url = f"https://api.unpaywall.org/v2/{quote(doi, safe='')}?email=research@example.com"
-            
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Check if there's an open access PDF
-                best_oa_location = data.get("best_oa_location")
-                if best_oa_location and best_oa_location.get("url_for_pdf"):
-                    pdf_url = best_oa_location["url_for_pdf"]
-                    return self._fetch_pdf_content(pdf_url)
-                
-                # Try other OA locations
-                oa_locations = data.get("oa_locations", [])
-                for location in oa_locations:
-                    if location.get("url_for_pdf"):
-                        content = self._fetch_pdf_content(location["url_for_pdf"])
-                        if content:
-                            return content
+
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status != 200:
+                    return None
+                data = await response.json()
+
+            # Check if there's an open access PDF
+            best_oa_location = data.get("best_oa_location")
+            if best_oa_location and best_oa_location.get("url_for_pdf"):
+                pdf_url = best_oa_location["url_for_pdf"]
+                return await self._fetch_pdf_content(session, pdf_url)
+
+            # Try other OA locations
+            oa_locations = data.get("oa_locations", [])
+            for location in oa_locations:
+                if location.get("url_for_pdf"):
+                    content = await self._fetch_pdf_content(session, location["url_for_pdf"])
+                    if content:
+                        return content
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             print(f"Error fetching from Unpaywall {doi}: {e}")
         return None
-    
-    def _fetch_core_content(self, paper_details: Dict) -> Optional[str]:
+
+    async def _fetch_core_content(self, session: aiohttp.ClientSession, paper_details: Dict) -> Optional[str]:
         """Fetch paper content from CORE API"""
         try:
             # CORE API search by title
             title = paper_details.get("title", "")
             if not title:
                 return None
-                
+
             url = "https://api.core.ac.uk/v3/search/works"
             params = {
                 "q": f'title:"{title}"',
                 "limit": 1
             }
-            
+
             # Note: CORE requires API key for production use
             # headers = {"Authorization": "Bearer YOUR_CORE_API_KEY"}
-            
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                results = data.get("results", [])
-                
-                if results and len(results) > 0:
-                    paper = results[0]
-                    
-                    # Check if full text is available
-                    if paper.get("fullText"):
-                        return paper["fullText"]
-                    
-                    # Check for downloadUrl
-                    download_url = paper.get("downloadUrl")
-                    if download_url:
-                        return self._fetch_pdf_content(download_url)
+
+            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status != 200:
+                    return None
+                data = await response.json()
+
+            results = data.get("results", [])
+
+            if results and len(results) > 0:
+                paper = results[0]
+
+                # Check if full text is available
+                if paper.get("fullText"):
+                    return paper["fullText"]
+
+                # Check for downloadUrl
+                download_url = paper.get("downloadUrl")
+                if download_url:
+                    return await self._fetch_pdf_content(session, download_url)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             print(f"Error fetching from CORE: {e}")
         return None
-    
+
+    def _cache_path(self, paper_id: str) -> str:
+        """Sharded cache path: paper_cache/ab/cdef...zst
+
+        The two-level sharding by hash prefix keeps directory lookups fast
+        once the cache holds thousands of papers.
+        """
+        digest = hashlib.sha256(paper_id.encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest[2:]}.zst")
+
     def _get_cached_content(self, paper_id: str) -> Optional[str]:
         """Retrieve cached paper content"""
-        cache_file = os.path.join(self.cache_dir, f"{paper_id}.txt")
+        cache_file = self._cache_path(paper_id)
         if os.path.exists(cache_file):
             try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
+                with open(cache_file, 'rb') as f:
+                    return zstandard.ZstdDecompressor().decompress(f.read()).decode('utf-8')
+            except Exception as e:
+                print(f"Error reading cache for {paper_id}: {e}")
+
+        # Fall back to the legacy uncompressed flat layout
+        legacy_file = os.path.join(self.cache_dir, f"{paper_id}.txt")
+        if os.path.exists(legacy_file):
+            try:
+                with open(legacy_file, 'r', encoding='utf-8') as f:
                     return f.read()
             except Exception as e:
                 print(f"Error reading cache for {paper_id}: {e}")
         return None
-    
+
     def _cache_content(self, paper_id: str, content: str):
-        """Cache paper content to disk"""
-        cache_file = os.path.join(self.cache_dir, f"{paper_id}.txt")
+        """Cache paper content to disk, zstd-compressed"""
+        cache_file = self._cache_path(paper_id)
         try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                f.write(content)
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, 'wb') as f:
+                f.write(zstandard.ZstdCompressor(level=3).compress(content.encode('utf-8')))
         except Exception as e:
-            print(f"Error caching content for {paper_id}: {e}")
\ No newline at end of file
+            print(f"Error caching content for {paper_id}: {e}")